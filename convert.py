@@ -1,81 +1,178 @@
 # File: convert.py
 
-import networkx as nx
-from graphviz import Digraph
+import xml.etree.ElementTree as ET
+from graphviz import Digraph, quoting
 from graph import Graph
 
+# GraphML attr.type -> converter for the <data> text; strings are kept as-is
+GRAPHML_BOOLEANS = {"true": True, "false": False, "1": True, "0": False}
+GRAPHML_TYPES = {
+    "boolean": lambda text: GRAPHML_BOOLEANS[text.lower()],
+    "int": int,
+    "integer": int,
+    "long": int,
+    "float": float,
+    "double": float,
+}
+
+def _local_name(tag):
+    """Strips the XML namespace from a tag, e.g. '{http://...}node' -> 'node'."""
+    return tag.rpartition("}")[2]
+
+def _read_data(elem, key_map):
+    """
+    Collects the <data> children of a <node> or <edge> element into a dict,
+    using key_map (key id -> (attribute name, converter or None for strings))
+    resolved once from the <key> declarations.
+    An empty <data> element is read as "", whatever its type, as networkx did.
+    """
+    data = {}
+    for child in elem:
+        if _local_name(child.tag) != "data":
+            continue
+        key = key_map.get(child.get("key"))
+        if key is None:
+            raise ValueError(f"Bad GraphML data: no key {child.get('key')}")
+        name, convert = key
+        if child.text is None:
+            data[name] = ""
+        else:
+            data[name] = child.text if convert is None else convert(child.text)
+    return data
+
+def _unknown_node(node_id):
+    """A cyjson node without GraphML data: label 'UnknownNode', no properties."""
+    return {
+        "data": {
+            "id": node_id,
+            "labels": ["UnknownNode"],
+            "properties": {}
+        }
+    }
+
 def graphml_to_arcana(graphml_file):
     """
     Reads a .graphml file and converts it into our Graph (CyJSON-like) data structure.
-    Uses networkx to parse the GraphML, then transforms each node and edge
-    into the 'elements' format in 'cyjson', ultimately returning a Graph.
+    Streams the GraphML with ElementTree.iterparse, transforming each node and edge
+    into the 'elements' format in 'cyjson' as soon as its element is closed and then
+    discarding the element, ultimately returning a Graph.
+    As with networkx, the XML edge ids become an 'id' edge property only when
+    the file has no parallel edges (the same source and target twice).
     """
-    # Read the GraphML file
-    g_nx = nx.read_graphml(graphml_file)
-    
+    key_map     = {}  # key id -> (attribute name, converter)
+    nodes_by_id = {}  # node id -> cyjson node, so repeated <node>s merge
+    edges       = []  # cyjson edges, in document order
+    graph_stack = []  # open <graph> elements, to detach finished nodes/edges
+    edge_ids    = []  # (edge properties, XML edge id), applied at the end
+    edge_pairs  = set()  # (source, target) pairs seen, to detect parallel edges
+    parallel    = False
+
+    for event, elem in ET.iterparse(graphml_file, events=("start", "end")):
+        tag = _local_name(elem.tag)
+        if event == "start":
+            if tag == "graph":
+                graph_stack.append(elem)
+            continue
+
+        if tag == "key":
+            key_map[elem.get("id")] = (
+                elem.get("attr.name") or elem.get("id"),
+                GRAPHML_TYPES.get(elem.get("attr.type", "string")),
+            )
+
+        elif tag == "node":
+            node_id = elem.get("id")
+            node_data = _read_data(elem, key_map)
+            # If the GraphML has an attribute 'labelV',
+            # we treat that as the "primary label" for the node;
+            # otherwise default to "UnknownNode".
+            # All other attributes are node properties.
+            label = node_data.pop('labelV', None)
+            cyjson_node = nodes_by_id.get(node_id)
+            if cyjson_node is None:
+                nodes_by_id[node_id] = {
+                    "data": {
+                        "id": node_id,
+                        "labels": ["UnknownNode" if label is None else label],
+                        "properties": node_data
+                    }
+                }
+            else:
+                # Repeated <node>: merge into the first one
+                if label is not None:
+                    cyjson_node["data"]["labels"] = [label]
+                cyjson_node["data"]["properties"].update(node_data)
+
+        elif tag == "edge":
+            edge_data = _read_data(elem, key_map)
+            # If there's an attribute 'labelE', treat that as the edge label
+            # otherwise fallback to 'UnknownEdge'
+            lbl = edge_data.pop('labelE', 'UnknownEdge')
+            # All other attributes are edge properties; GraphML also keeps
+            # the edge id as an XML attribute
+            source, target = elem.get("source"), elem.get("target")
+            if elem.get("id"):
+                edge_ids.append((edge_data, elem.get("id")))
+            if not parallel:
+                parallel = (source, target) in edge_pairs
+                edge_pairs.add((source, target))
+
+            edges.append({
+                "data": {
+                    "source": source,
+                    "target": target,
+                    "label": lbl,
+                    "properties": edge_data
+                }
+            })
+
+        elif tag == "graph":
+            graph_stack.pop()
+            continue
+
+        else:
+            continue
+
+        # Drop the finished element so memory stays bounded by one element
+        elem.clear()
+        if tag != "key" and graph_stack:
+            graph_stack[-1].remove(elem)
+
+    if not parallel:
+        for edge_data, edge_id in edge_ids:
+            edge_data["id"] = edge_id
+    del edge_ids, edge_pairs
+
+    # Endpoints that were only referenced by edges still become nodes
+    for cyjson_edge in edges:
+        for node_id in (cyjson_edge["data"]["source"], cyjson_edge["data"]["target"]):
+            if node_id not in nodes_by_id:
+                nodes_by_id[node_id] = _unknown_node(node_id)
+
     cyjson = {
         "elements": {
-            "nodes": [],
-            "edges": []
+            "nodes": list(nodes_by_id.values()),
+            "edges": edges
         }
     }
-    
-    # Process nodes
-    for node_id, node_data in g_nx.nodes(data=True):
-        # If the networkx GraphML has an attribute 'labelV',
-        # we treat that as the "primary label" for the node;
-        # otherwise default to "UnknownNode".
-        label = node_data.get('labelV', 'UnknownNode')
-        
-        cyjson_node = {
-            "data": {
-                "id": node_id,
-                "labels": [label],
-                "properties": {}
-            }
-        }
-        # Include all other attributes as node properties
-        for key, value in node_data.items():
-            if key != 'labelV':
-                cyjson_node["data"]["properties"][key] = value
-        
-        cyjson["elements"]["nodes"].append(cyjson_node)
-    
-    # Process edges
-    for source, target, edge_data in g_nx.edges(data=True):
-        # If there's an attribute 'labelE', treat that as the edge label
-        # otherwise fallback to 'UnknownEdge'
-        lbl = edge_data.get('labelE', 'UnknownEdge')
-        
-        cyjson_edge = {
-            "data": {
-                "source": source,
-                "target": target,
-                "label": lbl,
-                "properties": {}
-            }
-        }
-        # Include all other attributes as edge properties
-        for key, value in edge_data.items():
-            if key != 'labelE':
-                cyjson_edge["data"]["properties"][key] = value
-        
-        cyjson["elements"]["edges"].append(cyjson_edge)
-    
     return Graph(cyjson)
 
 def create_labeled_digraph(graph):
     """
     Given our custom Graph, build a Graphviz Digraph with labeled edges for visualization.
+    Edge lines are formatted straight into the Digraph's body, quoted the same
+    way Digraph.edge() would, skipping its per-call attribute handling.
     """
     dot = Digraph()
-        
+    append = dot.body.append
+    quote = quoting.quote
+    quote_edge = quoting.quote_edge
+
     # For edges with label(s)
-    for label, edges in graph.edges.items():
+    for edges in graph.edges.values():
         for e in edges:
-            # We call e.label_val or e.label() depending on how Edge is implemented
-            # In this code base, we do e.label() if it’s a method, or e.label_val directly if it’s an attribute
-            lbl = e.label_val  
-            dot.edge(e.source, e.target, label=lbl)
-    
+            append(
+                f"\t{quote_edge(e.source)} -> {quote_edge(e.target)} [label={quote(e.label_val)}]\n"
+            )
+
     return dot
@@ -1,9 +1,17 @@
 import json
+import sys
 from collections import defaultdict
 from collections.abc import Iterable
 from typing import Optional, List, Dict, Union, Set, Tuple
 
+def _intern(value):
+	"""sys.intern for str values; other ids (e.g. numbers from CyJSON) are kept as-is."""
+	return sys.intern(value) if type(value) is str else value
+
 class Node:
+	# Created per element like Edge, so also without a per-instance __dict__
+	__slots__ = ('id', 'labels', 'properties', '_graph', '_sources_cache', '_targets_cache')
+
 	def __init__(self, _id, *labels, **properties):
 		self.id = _id
 		self.labels = set(labels)
@@ -55,9 +63,9 @@ class Node:
 		if edge_label not in self._sources_cache:
 			if not self._graph:
 				return []
-			es = self._graph.edges.get(edge_label, [])
+			_, incoming = self._graph.adjacency(edge_label)
 			self._sources_cache[edge_label] = [
-				self._graph.nodes[e.source] for e in es if e.target == self.id
+				self._graph.nodes[s] for s in incoming.get(self.id, [])
 			]
 		return self._sources_cache[edge_label]
 
@@ -65,9 +73,9 @@ class Node:
 		if edge_label not in self._targets_cache:
 			if not self._graph:
 				return []
-			es = self._graph.edges.get(edge_label, [])
+			outgoing, _ = self._graph.adjacency(edge_label)
 			self._targets_cache[edge_label] = [
-				self._graph.nodes[e.target] for e in es if e.source == self.id
+				self._graph.nodes[t] for t in outgoing.get(self.id, [])
 			]
 		return self._targets_cache[edge_label]
 
@@ -84,6 +92,12 @@ class Node:
 		return json.dumps(self.to_dict())
 
 class Edge:
+	# Edges are by far the most numerous objects; no per-instance __dict__
+	__slots__ = (
+		'id', 'source', 'target', 'label_val', 'properties',
+		'_graph', '_cached_source_node', '_cached_target_node'
+	)
+
 	def __init__(self, source, target, label, **properties):
 		self.id = f'{source}-{label}-{target}'
 		self.source = source
@@ -198,20 +212,26 @@ def triplets(edge_list1: List[Edge], edge_list2: List[Edge]) -> Set[Tuple[str, s
 
 class Graph:
 	def __init__(self, graph_data: dict = None) -> None:
+		# edge_label -> (outgoing, incoming) node-id adjacency, built on demand
+		self._adjacency: Dict[str, Tuple[Dict[str, List[str]], Dict[str, List[str]]]] = {}
 		if not graph_data:
 			self.nodes: Dict[str, Node] = {}
 			self.edges: Dict[str, List[Edge]] = {}
 			return
 
+		# Node ids and edge labels are interned on ingest (for every input
+		# format): they are used as dict keys over and over, and interned
+		# strings compare by identity.
 		self.nodes: Dict[str, Node] = {}
 		for node_data in graph_data['elements']['nodes']:
-			n = Node(node_data['data']['id'], *node_data['data']['labels'], **node_data['data']['properties'])
+			d = node_data['data']
+			n = Node(_intern(d['id']), *d['labels'], **d['properties'])
 			self.nodes[n.id] = n
 
 		self.edges: Dict[str, List[Edge]] = {}
 		for edge_data in graph_data['elements']['edges']:
 			d = edge_data['data']
-			e = Edge(d['source'], d['target'], d['label'], **d['properties'])
+			e = Edge(_intern(d['source']), _intern(d['target']), _intern(d['label']), **d['properties'])
 			if e.label_val not in self.edges:
 				self.edges[e.label_val] = []
 			self.edges[e.label_val].append(e)
@@ -219,12 +239,28 @@ class Graph:
 		self._set_graph_refs()
 
 	def _set_graph_refs(self):
+		self._adjacency.clear()
 		for node in self.nodes.values():
 			node.set_graph(self)
 		for elist in self.edges.values():
 			for edge in elist:
 				edge.set_graph(self)
 
+	def adjacency(self, edge_label: str) -> Tuple[Dict[str, List[str]], Dict[str, List[str]]]:
+		"""
+		Returns (outgoing, incoming) for edge_label: node id -> ids of its
+		targets / sources, in edge order. Built with one pass over the
+		label's edges on first use, so per-node lookups don't rescan them.
+		"""
+		if edge_label not in self._adjacency:
+			outgoing = defaultdict(list)
+			incoming = defaultdict(list)
+			for e in self.edges.get(edge_label, []):
+				outgoing[e.source].append(e.target)
+				incoming[e.target].append(e.source)
+			self._adjacency[edge_label] = (dict(outgoing), dict(incoming))
+		return self._adjacency[edge_label]
+
 	def add_node(self, _id: str, labels=None, properties=None):
 		if _id in self.nodes:
 			pass  # Overwrite or warn if needed
@@ -241,6 +277,7 @@ class Graph:
 			self.edges[edge_label] = []
 		self.edges[edge_label].append(e)
 		e.set_graph(self)
+		self._adjacency.pop(edge_label, None)
 
 		# Invalidate caching for the involved nodes
 		self.nodes[source_id]._invalidate_cache()
@@ -274,6 +311,12 @@ class Graph:
 			if any(label in v.labels for label in labels)
 		}
 
+	def num_nodes(self) -> int:
+		return len(self.nodes)
+
+	def num_edges(self) -> int:
+		return sum(map(len, self.edges.values()))
+
 	def get_all_node_labels(self) -> Set[str]:
 		return {label for node in self.nodes.values() for label in node.labels}
 
@@ -437,6 +480,7 @@ class Graph:
 		return (sorted_nodes, node_deps)
 
 	def clean_up(self):
+		self._adjacency.clear()
 		for edge_type in list(self.edges.keys()):
 			self.edges[edge_type] = [
 				e for e in self.edges[edge_type]
@@ -444,6 +488,12 @@ class Graph:
 			]
 
 	def find_paths(self, *edge_sequence: List[str]) -> List[List[Edge]]:
+		"""
+		Returns the paths that follow edge_sequence, one edge per label
+		('-label' follows the label backwards). Each step looks up the
+		next edges by their source instead of scanning all edges of the
+		label for every path.
+		"""
 		def get_edges(label: str) -> List[Edge]:
 			if label.startswith('-'):
 				base_label = label[1:]
@@ -453,23 +503,29 @@ class Graph:
 			return self.edges.get(label, [])
 
 		def find_next(current_paths: List[List[Edge]], lbl: str) -> List[List[Edge]]:
+			candidates = get_edges(lbl)
+			if current_paths == [[]]:
+				return [[candidate] for candidate in candidates]
+			by_source = defaultdict(list)
+			for candidate in candidates:
+				by_source[candidate.source].append(candidate)
 			result = []
 			for path in current_paths:
-				last_node = path[-1].target if path else None
-				for candidate in get_edges(lbl):
-					if not path or candidate.source == last_node:
-						result.append(path + [candidate])
+				for candidate in by_source.get(path[-1].target, ()):
+					result.append(path + [candidate])
 			return result
 
 		paths = [[]]
 		for lbl in edge_sequence:
+			if not paths:
+				break
 			paths = find_next(paths, lbl)
 		return paths
 
 	def __repr__(self):
 		return json.dumps(self.to_dict())
 
-	def to_dict(self, *args: str, node_labels: Optional[Union[str, Iterable[str]]] = None) -> dict:
+	def select_elements(self, *args: str, node_labels: Optional[Union[str, Iterable[str]]] = None) -> Tuple[List[Node], List[Edge]]:
 		included_edge_labels = list(args) if args else list(self.edges.keys())
 		if node_labels == 'all':
 			included_node_labels = self.get_all_node_labels()
@@ -485,16 +541,44 @@ class Graph:
 			elif isinstance(node_labels, Iterable):
 				included_node_labels.update(node_labels)
 
-		included_nodes = {
-			k: v
-			for k, v in self.filter_nodes_by_labels(included_node_labels).items()
-		}
-		included_edges = {
-			lbl: eds for lbl, eds in self.edges.items() if lbl in included_edge_labels
-		}
+		included_nodes = list(self.filter_nodes_by_labels(included_node_labels).values())
+		included_edges = [
+			e for lbl, eds in self.edges.items() if lbl in included_edge_labels for e in eds
+		]
+		return included_nodes, included_edges
+
+	def to_dict(self, *args: str, node_labels: Optional[Union[str, Iterable[str]]] = None) -> dict:
+		included_nodes, included_edges = self.select_elements(*args, node_labels=node_labels)
 		return {
 			"elements": {
-				"nodes": [{"data": n.to_dict()['data']} for n in included_nodes.values()],
-				"edges": [{"data": e.to_dict()['data']} for e in sum(included_edges.values(), [])]
+				"nodes": [{"data": n.to_dict()['data']} for n in included_nodes],
+				"edges": [{"data": e.to_dict()['data']} for e in included_edges]
 			}
 		}
+
+class GraphQueryCache:
+	"""
+	Memoized label lookups on a Graph that is only read (e.g. the input graph
+	of the transformation passes), so each label's node/edge list is built
+	once and shared by every pass. The returned lists must not be mutated.
+	"""
+	def __init__(self, graph: Graph) -> None:
+		self.graph = graph
+		self._nodes_by_label: Optional[Dict[str, List[Node]]] = None
+		self._edges_by_label: Dict[str, List[Edge]] = {}
+
+	def nodes(self, label: str) -> List[Node]:
+		"""Same as graph.find_nodes(label=label); all labels are indexed in one pass."""
+		if self._nodes_by_label is None:
+			nodes_by_label = defaultdict(list)
+			for node in self.graph.nodes.values():
+				for lbl in node.labels:
+					nodes_by_label[lbl].append(node)
+			self._nodes_by_label = dict(nodes_by_label)
+		return self._nodes_by_label.get(label, [])
+
+	def edges(self, label: str) -> List[Edge]:
+		"""Same as graph.find_edges(label=label)."""
+		if label not in self._edges_by_label:
+			self._edges_by_label[label] = self.graph.find_edges(label=label)
+		return self._edges_by_label[label]
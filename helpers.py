@@ -1,21 +1,33 @@
 # File: helpers.py
 
 import re
+from functools import lru_cache
+
+_CAMEL_RE = re.compile(r'([a-z0-9])([A-Z])')
+
+# Renaissance property names -> our property names
+_PROPERTY_RENAMES = {"symbol": "simpleName", "name": "qualifiedName"}
+
+def _renamed(props):
+    """
+    Builds the renamed copy of props in a single pass
+    (symbol->simpleName, name->qualifiedName) and adds metaSrc='renaissance'.
+    """
+    renamed = {k: v for k, v in props.items() if k not in _PROPERTY_RENAMES}
+    for old_key, new_key in _PROPERTY_RENAMES.items():
+        if old_key in props:
+            renamed[new_key] = props[old_key]
+    renamed["metaSrc"] = "renaissance"
+    return renamed
 
 def rename_properties(props):
     """
     Renames 'symbol' -> 'simpleName' and 'name' -> 'qualifiedName' (if present),
     and adds metaSrc='renaissance'.
     
-    Modifies a copy of the dictionary so as not to alter the original in place.
+    Builds a new dictionary so as not to alter the original in place.
     """
-    props_new = dict(props)
-    if "symbol" in props_new:
-        props_new["simpleName"] = props_new.pop("symbol")
-    if "name" in props_new:
-        props_new["qualifiedName"] = props_new.pop("name")
-    props_new["metaSrc"] = "renaissance"
-    return props_new
+    return _renamed(props)
 
 def merge_properties(def_props, decl_props):
     """
@@ -25,14 +37,7 @@ def merge_properties(def_props, decl_props):
       - Then rename symbol->simpleName, name->qualifiedName
       - Add metaSrc='renaissance'
     """
-    merged = dict(decl_props)
-    merged.update(def_props)  # def_props overwrites collisions
-    if "symbol" in merged:
-        merged["simpleName"] = merged.pop("symbol")
-    if "name" in merged:
-        merged["qualifiedName"] = merged.pop("name")
-    merged["metaSrc"] = "renaissance"
-    return merged
+    return _renamed({**decl_props, **def_props})  # def_props overwrites collisions
 
 def parse_path_as_name(props, old_id=None):
     """
@@ -42,16 +47,16 @@ def parse_path_as_name(props, old_id=None):
     If there's no 'name', tries 'symbol' for simpleName,
     else uses old_id as fallback.
     """
-    props = dict(props)  # copy
-
-    path_val = props.pop("name", None)
-    symbol_val = props.pop("symbol", None)
+    path_val = props.get("name")
+    symbol_val = props.get("symbol")
+    props = {k: v for k, v in props.items() if k not in _PROPERTY_RENAMES}  # copy
 
     if path_val is not None:
         props["qualifiedName"] = path_val
         # Convert backslashes to forward slashes for uniform splitting
-        norm_path = path_val.replace("\\", "/")
-        last_part = norm_path.split("/")[-1] or norm_path
+        # (most paths have none, so skip the copy in that case)
+        norm_path = path_val.replace("\\", "/") if "\\" in path_val else path_val
+        last_part = norm_path.rpartition("/")[2] or norm_path
         props["simpleName"] = last_part
     else:
         # Fallback
@@ -66,10 +71,11 @@ def parse_path_as_name(props, old_id=None):
     props["metaSrc"] = "renaissance"
     return props
 
+@lru_cache(maxsize=4096)
 def normalize_label_camelcase(lbl):
     """
     Convert a CamelCase label like 'HeaderFile' -> 'header file',
     'ProjectCOrCpp' -> 'project c or cpp', etc.
+    The set of labels is small, so results are memoized.
     """
-    spaced = re.sub(r'([a-z0-9])([A-Z])', r'\1 \2', lbl)
-    return spaced.lower()
+    return _CAMEL_RE.sub(r'\1 \2', lbl).lower()
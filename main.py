@@ -3,13 +3,29 @@
 import sys
 import json
 import argparse
+import contextlib
+import gc
+import mmap
 import os
+from collections import ChainMap, defaultdict
+from itertools import chain
+
+try:
+    import orjson
+except ImportError:  # optional, falls back to the stdlib encoder
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # optional, only needed for MessagePack input/output
+    msgpack = None
 
 from convert import graphml_to_arcana
-from graph import Graph
+from graph import Graph, GraphQueryCache
 from transformations import (
     collect_structures_and_variables,
     collect_operations_and_macros,
+    link_structure_scripts,
     collect_files_and_associations,
     invert_parent_folder_edges,
     link_source_parentfolder_structures
@@ -19,19 +35,128 @@ from transformations import (
 def build_graph_from_nodes_edges(nodes, edges):
     """
     Helper that constructs a new Graph() instance
-    from a list of Node objects and a list of Edge objects.
+    from an iterable of Node objects and an iterable of Edge objects.
     """
     g = Graph()
-    # Insert nodes
-    for n in nodes:
-        g.nodes[n.id] = n
-    # Insert edges
+    g.nodes = {n.id: n for n in nodes}
+    # Group edges by label in a single pass
+    edges_by_label = defaultdict(list)
     for e in edges:
-        lbl = e.label_val  # or e.label() depending on your Edge class
-        g.edges.setdefault(lbl, []).append(e)
+        edges_by_label[e.label_val].append(e)
+    g.edges = dict(edges_by_label)
     return g
 
 
+def load_cyjson(input_file):
+    """
+    Reads a CyJSON (.json) file into a Graph.
+    With orjson installed, the file is memory-mapped and parsed in place,
+    so it is never copied into a Python bytes object first.
+    """
+    with open(input_file, "rb") as fin:
+        if orjson is None:
+            cyjson_data = json.load(fin)
+        else:
+            with mmap.mmap(fin.fileno(), 0, access=mmap.ACCESS_READ) as mm, memoryview(mm) as buf:
+                cyjson_data = orjson.loads(buf)
+    return Graph(cyjson_data)
+
+
+def load_msgpack(input_file):
+    """
+    Reads a CyJSON document stored as MessagePack (.msgpack),
+    as written by --format msgpack, into a Graph.
+    """
+    if msgpack is None:
+        raise ValueError("Reading .msgpack input requires the msgpack package.")
+    with open(input_file, "rb") as fin:
+        cyjson_data = msgpack.unpack(fin)
+    return Graph(cyjson_data)
+
+
+# Input file extension -> loader returning a Graph
+INPUT_LOADERS = {
+    ".graphml": graphml_to_arcana,
+    ".json": load_cyjson,
+    ".msgpack": load_msgpack,
+}
+
+
+def encode_record(obj):
+    """
+    Encodes a single JSON record as compact UTF-8 bytes,
+    using orjson when it is installed.
+    """
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, separators=(",", ":")).encode("utf-8")
+
+
+def open_output(path):
+    """
+    Opens `path` for binary writing; '-' means stdout,
+    so the final JSON can be piped into another tool.
+    """
+    if path == "-":
+        return contextlib.nullcontext(sys.stdout.buffer)
+    return open(path, "wb")
+
+
+def dump_json(obj, path, pretty=False):
+    """
+    Writes a whole JSON document to `path` ('-' for stdout),
+    encoding with orjson when it is installed.
+    """
+    with open_output(path) as fout:
+        if orjson is not None:
+            fout.write(orjson.dumps(obj, option=orjson.OPT_INDENT_2 if pretty else 0))
+        else:
+            fout.write(json.dumps(obj, indent=2 if pretty else None).encode("utf-8"))
+
+
+def write_graph_json(graph, fout):
+    """
+    Streams a Graph to the binary file object `fout` in CyJSON format,
+    encoding one node/edge record at a time (one record per line) instead
+    of building the whole graph.to_dict() first. Writes the same elements
+    as graph.to_dict().
+    """
+    nodes, edges = graph.select_elements()
+
+    fout.write(b'{"elements":{"nodes":[\n')
+    for i, n in enumerate(nodes):
+        if i:
+            fout.write(b",\n")
+        fout.write(encode_record(n.to_dict()))
+    fout.write(b'\n],"edges":[\n')
+    for i, e in enumerate(edges):
+        if i:
+            fout.write(b",\n")
+        fout.write(encode_record(e.to_dict()))
+    fout.write(b"\n]}}\n")
+
+
+def write_graph_msgpack(graph, fout):
+    """
+    Streams a Graph to the binary file object `fout` as MessagePack,
+    with the same CyJSON structure and elements as write_graph_json.
+    """
+    nodes, edges = graph.select_elements()
+    packer = msgpack.Packer()
+
+    fout.write(packer.pack_map_header(1))
+    fout.write(packer.pack("elements"))
+    fout.write(packer.pack_map_header(2))
+    fout.write(packer.pack("nodes"))
+    fout.write(packer.pack_array_header(len(nodes)))
+    for n in nodes:
+        fout.write(packer.pack(n.to_dict()))
+    fout.write(packer.pack("edges"))
+    fout.write(packer.pack_array_header(len(edges)))
+    for e in edges:
+        fout.write(packer.pack(e.to_dict()))
+
+
 def main():
     parser = argparse.ArgumentParser(
         description="Command-line tool to transform a .graphml or CyJSON (.json) file "
@@ -41,13 +166,20 @@ def main():
         "--input",
         "-i",
         required=True,
-        help="Path to the input file (.graphml or .json in CyJSON format)"
+        help="Path to the input file (.graphml, .json in CyJSON format, or .msgpack)"
     )
     parser.add_argument(
         "--output",
         "-o",
         required=True,
-        help="Path to the output .json file (final transformed graph)"
+        help="Path to the output file (final transformed graph), or '-' for stdout"
+    )
+    parser.add_argument(
+        "--format",
+        choices=["json", "msgpack"],
+        default="json",
+        help="Output format for the final graph; msgpack is smaller and faster "
+             "for programmatic consumers (default: json)"
     )
     parser.add_argument(
         "--ontology",
@@ -70,32 +202,37 @@ def main():
         action="store_true",
         help="Skip the folder-related transformations (ParentFolder edges, etc.)"
     )
+    parser.add_argument(
+        "--pretty",
+        action="store_true",
+        help="Indent the final JSON (slower; builds the whole document in memory)"
+    )
     args = parser.parse_args()
+    if args.format == "msgpack" and msgpack is None:
+        parser.error("--format msgpack requires the msgpack package")
 
     # 1) Determine input format by file extension
     input_file = args.input
     extension = os.path.splitext(input_file)[1].lower()
 
     # 2) Read the graph
-    print(f"Reading input from {args.input} ...", file=sys.stderr)
-    if extension == ".graphml":
-        original_graph = graphml_to_arcana(input_file)  
-    elif extension == ".json":
-        # Treat this as CyJSON
-        with open(input_file, "r", encoding="utf-8") as fin:
-            cyjson_data = json.load(fin)
-        original_graph = Graph(cyjson_data)
-    else:
+    loader = INPUT_LOADERS.get(extension)
+    if loader is None:
         raise ValueError(f"Unsupported input file extension '{extension}'. "
-                         "Supported: .graphml or .json (CyJSON).")
+                         "Supported: .graphml, .json (CyJSON) or .msgpack (CyJSON as MessagePack).")
+    print(f"Reading input from {args.input} ...", file=sys.stderr)
+    original_graph = loader(input_file)
 
-    print(f"Done reading. Found {len(original_graph.find_nodes())} nodes and "
-          f"{len(original_graph.find_edges())} edges in the original graph.",
+    print(f"Done reading. Found {original_graph.num_nodes()} nodes and "
+          f"{original_graph.num_edges()} edges in the original graph.",
           file=sys.stderr)
 
+    # Every step reads original_graph; share its label lookups between them
+    queries = GraphQueryCache(original_graph)
+
     # 3) Step A: Collect structures & variables
     print("Collecting structures & variables...", file=sys.stderr)
-    s_nodes, s_edges, s_map = collect_structures_and_variables(original_graph)
+    s_nodes, s_edges, s_map = collect_structures_and_variables(original_graph, queries=queries)
     print(f"  -> structures/variables: {len(s_nodes)} nodes, {len(s_edges)} edges", file=sys.stderr)
 
     # 4) Step B: Collect operations & macros (unless --no-ops)
@@ -104,35 +241,40 @@ def main():
     o_map = {}
     if not args.no_ops:
         print("Collecting operations & macros...", file=sys.stderr)
-        o_nodes, o_edges, o_map = collect_operations_and_macros(original_graph, s_map)
+        o_nodes, o_edges, o_map = collect_operations_and_macros(original_graph, queries=queries)
+        # Attaching operations/macros to structures needs the result of both steps
+        o_edges.extend(link_structure_scripts(original_graph, s_map, o_map, o_nodes))
         print(f"  -> operations/macros: {len(o_nodes)} nodes, {len(o_edges)} edges", file=sys.stderr)
 
-    # Combine structure & operation mappings so file transformations can see them
-    combined_map_1 = dict(s_map)
-    combined_map_1.update(o_map)
+    # Combine structure & operation mappings so file transformations can see them.
+    # The later steps only read these maps (each builds its own combined copy),
+    # so they are chained rather than copied; o_map takes priority over s_map.
+    combined_map_1 = ChainMap(o_map, s_map)
 
     # 5) Step C: Collect files & associations (unless --no-files)
     f_nodes = []
     f_edges = []
-    combo_map_2 = dict(combined_map_1)
+    combo_map_2 = combined_map_1
     if not args.no_files:
         print("Collecting files & associations...", file=sys.stderr)
         f_nodes, f_edges, combo_map_2 = collect_files_and_associations(
             original_graph,
             combined_map_1,
-            s_nodes + o_nodes
+            chain(s_nodes, o_nodes),
+            queries=queries
         )
         print(f"  -> files: {len(f_nodes)} nodes, {len(f_edges)} edges", file=sys.stderr)
 
     # 6) Step D: Invert parent folder edges (unless --no-folders)
     folder_nodes = []
     folder_edges = []
-    combo_map_3 = dict(combo_map_2)
+    combo_map_3 = combo_map_2
     if not args.no_folders:
         print("Inverting folder edges (ParentFolder->contains)...", file=sys.stderr)
         folder_nodes, folder_edges, combo_map_3 = invert_parent_folder_edges(
             original_graph,
-            combo_map_2
+            combo_map_2,
+            queries=queries
         )
         print(f"  -> folders: {len(folder_nodes)} nodes, {len(folder_edges)} edges", file=sys.stderr)
 
@@ -140,34 +282,50 @@ def main():
     extra_nest_edges = []
     if not args.no_folders and not args.no_files:
         print("Linking source->parentfolder->... structures...", file=sys.stderr)
-        new_nodes_all = s_nodes + o_nodes + f_nodes + folder_nodes
+        new_nodes_all = chain(s_nodes, o_nodes, f_nodes, folder_nodes)
         extra_nest_edges = link_source_parentfolder_structures(
             original_graph,
             combo_map_3,
-            new_nodes_all
+            new_nodes_all,
+            queries=queries
         )
         print(f"  -> extra nest edges: {len(extra_nest_edges)}", file=sys.stderr)
 
     # Combine everything
-    all_nodes = s_nodes + o_nodes + f_nodes + folder_nodes
-    all_edges = s_edges + o_edges + f_edges + folder_edges + extra_nest_edges
+    all_nodes = chain(s_nodes, o_nodes, f_nodes, folder_nodes)
+    all_edges = chain(s_edges, o_edges, f_edges, folder_edges, extra_nest_edges)
 
     final_graph = build_graph_from_nodes_edges(all_nodes, all_edges)
+
+    # Everything below only needs final_graph. Drop the per-step lists, the id
+    # mappings and the original graph before clean-up and serialization; the
+    # original graph's nodes point back at it, so the cycle needs a collection.
+    del all_nodes, all_edges
+    del s_nodes, s_edges, o_nodes, o_edges, f_nodes, f_edges, folder_nodes, folder_edges, extra_nest_edges
+    del s_map, o_map, combined_map_1, combo_map_2, combo_map_3
+    del original_graph, queries
+    gc.collect()
+
     final_graph.clean_up()
 
-    print(f"Final graph: {len(final_graph.find_nodes())} nodes, {len(final_graph.find_edges())} edges.", file=sys.stderr)
+    print(f"Final graph: {final_graph.num_nodes()} nodes, {final_graph.num_edges()} edges.", file=sys.stderr)
 
     # If user wants an ontology
     if args.ontology:
         onto = final_graph.generate_ontology()
-        with open(args.ontology, "w", encoding="utf-8") as f:
-            json.dump(onto.to_dict(), f, indent=2)
+        dump_json(onto.to_dict(), args.ontology, pretty=True)
         print(f"Wrote ontology to {args.ontology}", file=sys.stderr)
 
-    # Write final JSON
-    with open(args.output, "w", encoding="utf-8") as fout:
-        json.dump(final_graph.to_dict(), fout, indent=2)
-    print(f"Wrote final JSON to {args.output}", file=sys.stderr)
+    # Write final graph
+    if args.format == "msgpack":
+        with open_output(args.output) as fout:
+            write_graph_msgpack(final_graph, fout)
+    elif args.pretty:
+        dump_json(final_graph.to_dict(), args.output, pretty=True)
+    else:
+        with open_output(args.output) as fout:
+            write_graph_json(final_graph, fout)
+    print(f"Wrote final {args.format.upper()} to {'stdout' if args.output == '-' else args.output}", file=sys.stderr)
 
 
 if __name__ == "__main__":
@@ -1,7 +1,8 @@
 # File: transformations.py
 
 from collections import defaultdict
-from graph import Node, Edge
+from itertools import chain
+from graph import Node, Edge, GraphQueryCache
 from helpers import (
     rename_properties,
     merge_properties,
@@ -10,7 +11,7 @@ from helpers import (
 )
 
 
-def collect_structures_and_variables(original_graph):
+def collect_structures_and_variables(original_graph, *, queries=None):
     """
     Collect Structures and Variables (and handle merges + inherits) from CppDeclaration nodes.
     
@@ -29,41 +30,60 @@ def collect_structures_and_variables(original_graph):
         new_nodes_list: [Node, ...]
         new_edges_list: [Edge, ...]
         id_mapping: { old_id -> new_id }
+
+    queries: optional GraphQueryCache over original_graph, shared between passes.
     """
+    if queries is None:
+        queries = GraphQueryCache(original_graph)
 
     # 0) Gather relevant nodes
-    cpp_decl_nodes    = original_graph.find_nodes(label="CppDeclaration")
-    cpp_fwddecl_nodes = original_graph.find_nodes(label="CppForwardDeclaration")
+    cpp_decl_nodes    = queries.nodes("CppDeclaration")
+    cpp_fwddecl_nodes = queries.nodes("CppForwardDeclaration")
 
     # Union-Find Preprocessing for CppAlias merges
-    all_decl_ids = set(n.id for n in cpp_decl_nodes) | set(n.id for n in cpp_fwddecl_nodes)
-    node_props   = {}
+    all_decl_ids = {n.id for n in chain(cpp_decl_nodes, cpp_fwddecl_nodes)}
     parent       = {}
+    size         = {}  # root -> number of members, for union by size
+    leader       = {}  # root -> id the merged group is named after
     merged_props = {}
 
-    for n in (cpp_decl_nodes + cpp_fwddecl_nodes):
-        node_props[n.id] = dict(n.properties)  # original props
-    for old_id in all_decl_ids:
-        parent[old_id] = old_id
-        merged_props[old_id] = dict(node_props[old_id])  # start with local copy
+    for n in chain(cpp_decl_nodes, cpp_fwddecl_nodes):
+        parent[n.id] = n.id
+        size[n.id] = 1
+        leader[n.id] = n.id
+        merged_props[n.id] = dict(n.properties)  # start with local copy of original props
 
     def find(x):
-        if parent[x] != x:
-            parent[x] = find(parent[x])
-        return parent[x]
+        # Iterative, with full path compression
+        root = x
+        while parent[root] != root:
+            root = parent[root]
+        while parent[x] != root:
+            parent[x], x = root, parent[x]
+        return root
 
     def union(main_id, other_id):
         rep_main = find(main_id)
         rep_other = find(other_id)
         if rep_main == rep_other:
             return
-        parent[rep_other] = rep_main
         # Merging properties, prioritizing rep_main
-        pm = merged_props[rep_main]
-        po = merged_props[rep_other]
+        pm = merged_props.pop(rep_main)
+        po = merged_props.pop(rep_other)
         for k, v in po.items():
             if k not in pm:
                 pm[k] = v
+        name = leader.pop(rep_main)
+        del leader[rep_other]
+        # Attach the smaller set under the larger one; the merged group keeps
+        # rep_main's properties and name whichever of the two stays root
+        root, child = rep_main, rep_other
+        if size[root] < size[child]:
+            root, child = child, root
+        parent[child] = root
+        size[root] += size.pop(child)
+        merged_props[root] = pm
+        leader[root] = name
 
     # Process CppAlias
     # alias_edges = original_graph.find_edges(label="CppAlias")
@@ -84,15 +104,29 @@ def collect_structures_and_variables(original_graph):
     group_has_contains = defaultdict(bool)
     group_has_inherits = defaultdict(bool)
 
+    # Adjacency (node id -> neighbour ids) for CppContains, built once
+    # instead of scanning the edges for every declaration
+    contains_out, _ = original_graph.adjacency("CppContains")
+
+    # (parent declaration id, contained id) pairs, turned into edges once ids are assigned
+    pending_contains = []
+
     # For each CppDeclaration, if it has n.targets("CppContains") or n.targets("CppInherits"), mark as structure
     for n in cpp_decl_nodes:
-        rep = find(n.id)
         # Check if n has any CppContains
-        if n.targets("CppContains"):
-            group_has_contains[rep] = True
-        # If also want to treat n.targets("CppInherits") or n.sources("CppInherits")
-        if n.targets("CppInherits") or n.sources("CppInherits"):
-            group_has_inherits[rep] = True
+        children = contains_out.get(n.id)
+        if children:
+            group_has_contains[find(n.id)] = True
+            pending_contains.extend((n.id, child_id) for child_id in children)
+
+    # Also treat n.targets("CppInherits") or n.sources("CppInherits"): mark the
+    # groups of both endpoints. The same edges give the specializes edges below.
+    cpp_decl_ids   = {n.id for n in cpp_decl_nodes}
+    inherits_edges = queries.edges("CppInherits")
+    for ed in inherits_edges:
+        for old_id in (ed.source, ed.target):
+            if old_id in cpp_decl_ids:
+                group_has_inherits[find(old_id)] = True
 
     new_nodes_dict = {}
     id_mapping     = {}
@@ -111,12 +145,12 @@ def collect_structures_and_variables(original_graph):
             # structure
             props_renamed["kind"] = "class/struct/template"
             new_labels = ["Structure"]
-            node_id = f"class{rep_id}"
+            node_id = f"class{leader[rep_id]}"
         else:
             # variable
             props_renamed["kind"] = "variable"
             new_labels = ["Variable"]
-            node_id = f"variable{rep_id}"
+            node_id = f"variable{leader[rep_id]}"
 
         new_node = Node(node_id, *new_labels, **props_renamed)
         new_nodes_dict[node_id] = new_node
@@ -125,38 +159,33 @@ def collect_structures_and_variables(original_graph):
             id_mapping[m] = node_id
 
     # 2) Build edges: hasVariable, contains, specializes
-    new_edges_dict = defaultdict(list)
+    new_edges_list = []
+    add_edge = new_edges_list.append
 
     # hasVariable / contains
-    old_declarations = original_graph.find_nodes(label="CppDeclaration")
-    for old_decl_node in old_declarations:
-        parent_new_id   = id_mapping[old_decl_node.id]
-        parent_new_node = new_nodes_dict[parent_new_id]
-        if "Structure" not in parent_new_node.labels:
-            # skip if not structure
+    # (a declaration with CppContains children always became a Structure)
+    for parent_old_id, child_id in pending_contains:
+        if child_id not in id_mapping:
             continue
-
-        for child_n in old_decl_node.targets("CppContains"):
-            if child_n.id not in id_mapping:
-                continue
-            child_new_id   = id_mapping[child_n.id]
-            child_new_node = new_nodes_dict[child_new_id]
-
-            if "Variable" in child_new_node.labels:
-                # hasVariable
-                e_hv = Edge(parent_new_id, child_new_id, "hasVariable", metaSrc="renaissance")
-                new_edges_dict["hasVariable"].append(e_hv)
-                # mark variable as 'field'
-                child_new_node.properties["kind"] = "field"
-
-            elif "Structure" in child_new_node.labels:
-                # nested structure => 'contains' + label parent as Container
-                parent_new_node.labels.add("Container")
-                e_ct = Edge(parent_new_id, child_new_id, "contains", metaSrc="renaissance")
-                new_edges_dict["contains"].append(e_ct)
+        parent_new_id   = id_mapping[parent_old_id]
+        parent_new_node = new_nodes_dict[parent_new_id]
+        child_new_id   = id_mapping[child_id]
+        child_new_node = new_nodes_dict[child_new_id]
+
+        if "Variable" in child_new_node.labels:
+            # hasVariable
+            e_hv = Edge(parent_new_id, child_new_id, "hasVariable", metaSrc="renaissance")
+            add_edge(e_hv)
+            # mark variable as 'field'
+            child_new_node.properties["kind"] = "field"
+
+        elif "Structure" in child_new_node.labels:
+            # nested structure => 'contains' + label parent as Container
+            parent_new_node.labels.add("Container")
+            e_ct = Edge(parent_new_id, child_new_id, "contains", metaSrc="renaissance")
+            add_edge(e_ct)
 
     # specializes
-    inherits_edges = original_graph.find_edges(label="CppInherits")
     for ed in inherits_edges:
         old_s = ed.source
         old_t = ed.target
@@ -167,45 +196,42 @@ def collect_structures_and_variables(original_graph):
             tgt_node = new_nodes_dict[tgt_id]
             if "Structure" in src_node.labels and "Structure" in tgt_node.labels:
                 e_sp = Edge(src_id, tgt_id, "specializes", metaSrc="renaissance")
-                new_edges_dict["specializes"].append(e_sp)
+                add_edge(e_sp)
 
     # finalize
     new_nodes_list = list(new_nodes_dict.values())
-    new_edges_list = []
-    for lbl, edge_list in new_edges_dict.items():
-        new_edges_list.extend(edge_list)
-
     return (new_nodes_list, new_edges_list, id_mapping)
 
 
-def collect_operations_and_macros(graph, structure_mapping):
+def collect_operations_and_macros(graph, *, queries=None):
     """
     1) Merge (CppFunctionDefinition -> CppFunctionDeclaration) into Operation nodes.
     2) Create single Operation nodes for leftover definitions/declarations that don't merge.
+       All Operations start with kind="function"; link_structure_scripts upgrades methods.
     3) Create Script nodes for CppMacroDefinition (kind="macro").
-    4) If a function/macro is contained by a structure (old CppContains from that structure),
-       then:
-         - If it's an Operation, set 'kind'="method", else if it's a Script (macro), keep 'kind'="macro"
-         - Create structure->(operation/script) edge labeled "hasScript".
-    5) Convert CppCalls edges => "invoke" edges among these new nodes.
+    4) Convert CppCalls edges => "invoke" edges among these new nodes.
        (Because macros are “just like function declarations,” we handle them in calls too.)
-    6) Return (new_nodes_list, new_edges_list, function_mapping).
+    5) Return (new_nodes_list, new_edges_list, function_mapping).
 
-    structure_mapping: old_id (of class/struct) -> new_id (of Structure)
+    This does not depend on the structures (it no longer takes structure_mapping);
+    link_structure_scripts then attaches the new nodes to their structures.
+
+    queries: optional (keyword-only) GraphQueryCache over graph, shared between passes.
     """
+    if queries is None:
+        queries = GraphQueryCache(graph)
 
     # Gather function declarations/definitions/macros
-    declarations = graph.find_nodes(label="CppFunctionDeclaration")
-    definitions  = graph.find_nodes(label="CppFunctionDefinition")
-    macros       = graph.find_nodes(label="CppMacroDefinition")
+    declarations = queries.nodes("CppFunctionDeclaration")
+    definitions  = queries.nodes("CppFunctionDefinition")
+    macros       = queries.nodes("CppMacroDefinition")
 
     decl_by_id = {n.id: n for n in declarations}
     defn_by_id = {n.id: n for n in definitions}
     macr_by_id = {n.id: n for n in macros}
 
-    implements_edges = graph.find_edges(label="CppImplements")  # definition->declaration
-    calls_edges      = graph.find_edges(label="CppCalls")
-    contains_edges   = graph.find_edges(label="CppContains")
+    implements_edges = queries.edges("CppImplements")  # definition->declaration
+    calls_edges      = queries.edges("CppCalls")
 
     # Build mapping def->decl
     decl_for_defn = defaultdict(list)
@@ -218,7 +244,7 @@ def collect_operations_and_macros(graph, structure_mapping):
             defn_for_decl[dcl_id].append(dfn_id)
 
     new_nodes_dict   = {}
-    new_edges_dict   = defaultdict(list)
+    new_edges_list   = []
     function_mapping = {}
     handled          = set()
 
@@ -234,6 +260,7 @@ def collect_operations_and_macros(graph, structure_mapping):
                 continue
             dcl_node = decl_by_id[dcl_id]
             merged = merge_properties(def_node.properties, dcl_node.properties)
+            merged["kind"] = "function"
             new_op_id = f"function{def_id}_{dcl_id}"
             op_node = Node(new_op_id, "Operation", **merged)
             new_nodes_dict[new_op_id] = op_node
@@ -245,6 +272,7 @@ def collect_operations_and_macros(graph, structure_mapping):
     for def_id, def_node in defn_by_id.items():
         if def_id not in handled:
             props = rename_properties(def_node.properties)
+            props["kind"] = "function"
             new_id = f"funcdef{def_id}"
             op_node = Node(new_id, "Operation", **props)
             new_nodes_dict[new_id] = op_node
@@ -255,6 +283,7 @@ def collect_operations_and_macros(graph, structure_mapping):
     for dcl_id, dcl_node in decl_by_id.items():
         if dcl_id not in handled:
             props = rename_properties(dcl_node.properties)
+            props["kind"] = "function"
             new_id = f"funcdecl{dcl_id}"
             op_node = Node(new_id, "Operation", **props)
             new_nodes_dict[new_id] = op_node
@@ -271,67 +300,72 @@ def collect_operations_and_macros(graph, structure_mapping):
             new_nodes_dict[script_id] = script_node
             function_mapping[mac_id] = script_id
 
-    # Check containment => hasScript edges
-    contains_map = defaultdict(list)
-    for e in contains_edges:
-        contains_map[e.target].append(e.source)
-
-    all_func_ids = list(defn_by_id.keys()) + list(decl_by_id.keys()) + list(macr_by_id.keys())
-
-    for old_id in all_func_ids:
-        new_id = function_mapping.get(old_id)
-        if not new_id or new_id not in new_nodes_dict:
-            continue
-        node_obj = new_nodes_dict[new_id]
-
-        # If any parent is in structure_mapping => create structure->(op/script) = "hasScript"
-        # and if it's an Operation => set kind=method
-        parents = contains_map[old_id]
-        is_method = False
-        for p in parents:
-            if p in structure_mapping:
-                struct_new_id = structure_mapping[p]
-                e_hs = Edge(struct_new_id, new_id, "hasScript")
-                new_edges_dict["hasScript"].append(e_hs)
-                if "Operation" in node_obj.labels:
-                    node_obj.properties["kind"] = "method"
-
-        # If it's an Operation and not method => kind=function
-        if "Operation" in node_obj.labels:
-            if node_obj.properties.get("kind") != "method":
-                node_obj.properties["kind"] = "function"
-        # If it's a Script => keep "macro"
-
     # calls => invoke
-    calls_map = defaultdict(set)
-    for e in calls_edges:
-        calls_map[e.source].add(e.target)
+    # (distinct (caller, callee) pairs, translated into distinct invoke pairs;
+    # a declaration and its definition share one Operation, so their calls merge)
+    calls_pairs = {(e.source, e.target) for e in calls_edges}
 
     invoke_pairs = set()
-    for old_src, old_targets in calls_map.items():
-        if old_src not in function_mapping:
-            continue
-        new_src = function_mapping[old_src]
-        for ot in old_targets:
-            if ot not in function_mapping:
-                continue
-            new_tgt = function_mapping[ot]
-            if new_src != new_tgt:
-                invoke_pairs.add((new_src, new_tgt))
+    mget = function_mapping.get
+    for old_src, old_tgt in calls_pairs:
+        new_src = mget(old_src)
+        new_tgt = mget(old_tgt)
+        if new_src is not None and new_tgt is not None and new_src != new_tgt:
+            invoke_pairs.add((new_src, new_tgt))
 
     for (s, t) in invoke_pairs:
         e_invoke = Edge(s, t, "invoke")
-        new_edges_dict["invoke"].append(e_invoke)
+        new_edges_list.append(e_invoke)
 
     new_nodes_list = list(new_nodes_dict.values())
+    return (new_nodes_list, new_edges_list, function_mapping)
+
+
+def link_structure_scripts(graph, structure_mapping, function_mapping, new_nodes_list):
+    """
+    Attach the Operation/Script nodes from collect_operations_and_macros to their structures.
+    If a function/macro is contained by a structure (old CppContains from that structure),
+    then:
+      - If it's an Operation, set 'kind'="method", else if it's a Script (macro), keep 'kind'="macro"
+      - Create structure->(operation/script) edge labeled "hasScript".
+    Operations not contained by any structure keep the 'kind'="function" they were created with.
+
+    structure_mapping: old_id (of class/struct) -> new_id (of Structure)
+    function_mapping:  old_id (of function/macro) -> new_id (of Operation/Script)
+
+    Returns a list of newly created Edge objects.
+    """
+    new_nodes_dict = {n.id: n for n in new_nodes_list}
     new_edges_list = []
-    for lbl, elst in new_edges_dict.items():
-        new_edges_list.extend(elst)
 
-    return (new_nodes_list, new_edges_list, function_mapping)
+    # Check containment => hasScript edges (contained id -> container ids)
+    _, contains_map = graph.adjacency("CppContains")
+
+    for old_id, new_id in function_mapping.items():
+        if new_id not in new_nodes_dict:
+            continue
+        node_obj = new_nodes_dict[new_id]
+
+        # If any parent is in structure_mapping => create structure->(op/script) = "hasScript"
+        # and if it's an Operation => set kind=method
+        # Parents merged into the same Structure get a single edge
+        parents = contains_map.get(old_id, [])
+        struct_parents = {structure_mapping[p] for p in parents if p in structure_mapping}
+        for struct_new_id in struct_parents:
+            e_hs = Edge(struct_new_id, new_id, "hasScript")
+            new_edges_list.append(e_hs)
+        # (Operations start out as kind=function; Scripts keep "macro")
+        if struct_parents and "Operation" in node_obj.labels:
+            node_obj.properties["kind"] = "method"
+
+    return new_edges_list
+
 
+# Kinds of non-file nodes, deciding what a Source edge to a file turns into
+_MEMBER_VARIABLE, _MEMBER_SCRIPT, _MEMBER_STRUCTURE = range(3)
 
-def collect_files_and_associations(original_graph, existing_mapping, new_nodes_list):
+
+def collect_files_and_associations(original_graph, existing_mapping, new_nodes_list, *, queries=None):
     """
     Convert SourceFile, HeaderFile, OtherFile into Structure(kinds) = 
       'source file', 'header file', 'other file'.
@@ -343,21 +377,35 @@ def collect_files_and_associations(original_graph, existing_mapping, new_nodes_l
       2) If a class/struct references a file by 'Source' => class->file = association.
       3) Convert 'CppUses' => 'uses' from file->someNode.
 
+    new_nodes_list may be any iterable of the already-created nodes; it is read once.
+    queries is an optional GraphQueryCache over original_graph, shared between passes.
+
     Returns: (new_file_nodes_list, new_edges_list, combined_mapping)
     """
-
-    # We want to look up new nodes from existing + new_nodes_list
-    new_nodes_dict = {nd.id: nd for nd in new_nodes_list}
+    if queries is None:
+        queries = GraphQueryCache(original_graph)
+
+    # We want to look up new nodes from existing + new_nodes_list.
+    # Only their kind matters here (decided once per node rather than
+    # re-testing label sets for every Source edge)
+    member_kinds = {}
+    for nd in new_nodes_list:
+        if "Variable" in nd.labels:
+            member_kinds[nd.id] = _MEMBER_VARIABLE
+        elif "Operation" in nd.labels or "Script" in nd.labels:
+            member_kinds[nd.id] = _MEMBER_SCRIPT
+        elif "Structure" in nd.labels:
+            member_kinds[nd.id] = _MEMBER_STRUCTURE
 
     from collections import defaultdict
     new_file_nodes_dict = {}
-    new_edges_dict      = defaultdict(list)
+    new_edges_list      = []
     combined_mapping    = dict(existing_mapping)
 
     # Gather
-    sfiles  = original_graph.find_nodes(label="SourceFile")
-    hfiles  = original_graph.find_nodes(label="HeaderFile")
-    ofiles  = original_graph.find_nodes(label="OtherFile")
+    sfiles  = queries.nodes("SourceFile")
+    hfiles  = queries.nodes("HeaderFile")
+    ofiles  = queries.nodes("OtherFile")
 
     # parse_path helper => from helpers.py
     for old_node in sfiles:
@@ -386,71 +434,67 @@ def collect_files_and_associations(original_graph, existing_mapping, new_nodes_l
 
     # Source edges => invert
     var_func_to_files = defaultdict(set)
-    source_edges = original_graph.find_edges(label="Source")
-
-    def get_new_node_labels(old_id):
-        # Look up new ID, then check either new_file_nodes_dict or new_nodes_dict
-        nid = combined_mapping.get(old_id)
-        if not nid:
-            return set()
-        if nid in new_file_nodes_dict:
-            return new_file_nodes_dict[nid].labels
-        if nid in new_nodes_dict:
-            return new_nodes_dict[nid].labels
-        return set()
+    source_edges = queries.edges("Source")
 
+    cmget = combined_mapping.get
+    add_edge = new_edges_list.append
+    # association edges already emitted, as (source id, target id)
+    emitted_assoc = set()
     for e in source_edges:
         old_s = e.source
         old_t = e.target
-        new_s = combined_mapping.get(old_s, None)
-        new_t = combined_mapping.get(old_t, None)
+        new_s = cmget(old_s)
+        new_t = cmget(old_t)
 
         s_is_file = (new_s in new_file_nodes_dict)
         t_is_file = (new_t in new_file_nodes_dict)
 
-        s_labels = get_new_node_labels(old_s)
-        t_labels = get_new_node_labels(old_t)
-
         # var/func => file => invert => file->var/func
         if (not s_is_file) and t_is_file and new_s:
             file_id = new_t
             main_id = new_s
-            # check if s_labels is "Variable", "Operation"/"Script", or "Structure"
-            if "Variable" in s_labels:
+            # check if new_s is a "Variable", "Operation"/"Script", or "Structure"
+            s_kind = member_kinds.get(new_s)
+            if s_kind == _MEMBER_VARIABLE:
                 e_hv = Edge(file_id, main_id, "hasVariable")
-                new_edges_dict["hasVariable"].append(e_hv)
+                add_edge(e_hv)
                 var_func_to_files[old_s].add(old_t)
-            elif {"Operation", "Script"} & s_labels:
+            elif s_kind == _MEMBER_SCRIPT:
                 e_hs = Edge(file_id, main_id, "hasScript")
-                new_edges_dict["hasScript"].append(e_hs)
+                add_edge(e_hs)
                 var_func_to_files[old_s].add(old_t)
-            elif "Structure" in s_labels:
+            elif s_kind == _MEMBER_STRUCTURE:
                 # class->file => association
-                e_assoc = Edge(main_id, file_id, "association")
-                new_edges_dict["association"].append(e_assoc)
+                if (main_id, file_id) not in emitted_assoc:
+                    emitted_assoc.add((main_id, file_id))
+                    e_assoc = Edge(main_id, file_id, "association")
+                    add_edge(e_assoc)
 
         # file => var/func => invert => file->var/func
         elif s_is_file and (not t_is_file) and new_t:
             file_id = new_s
             main_id = new_t
-            if "Variable" in t_labels:
+            t_kind = member_kinds.get(new_t)
+            if t_kind == _MEMBER_VARIABLE:
                 e_hv = Edge(file_id, main_id, "hasVariable")
-                new_edges_dict["hasVariable"].append(e_hv)
+                add_edge(e_hv)
                 var_func_to_files[old_t].add(old_s)
-            elif {"Operation", "Script"} & t_labels:
+            elif t_kind == _MEMBER_SCRIPT:
                 e_hs = Edge(file_id, main_id, "hasScript")
-                new_edges_dict["hasScript"].append(e_hs)
+                add_edge(e_hs)
                 var_func_to_files[old_t].add(old_s)
-            elif "Structure" in t_labels:
+            elif t_kind == _MEMBER_STRUCTURE:
                 # class->file => association
-                e_assoc = Edge(main_id, file_id, "association")
-                new_edges_dict["association"].append(e_assoc)
+                if (main_id, file_id) not in emitted_assoc:
+                    emitted_assoc.add((main_id, file_id))
+                    e_assoc = Edge(main_id, file_id, "association")
+                    add_edge(e_assoc)
 
     # If a single var/func references both SourceFile and HeaderFile => structure->structure
     for old_vf, file_ids in var_func_to_files.items():
         sfile_ids, hfile_ids = [], []
         for fid in file_ids:
-            new_fid = combined_mapping.get(fid)
+            new_fid = cmget(fid)
             if new_fid in new_file_nodes_dict:
                 kindv = new_file_nodes_dict[new_fid].properties.get("kind","")
                 if kindv == "source file":
@@ -459,30 +503,29 @@ def collect_files_and_associations(original_graph, existing_mapping, new_nodes_l
                     hfile_ids.append(new_fid)
         for sfid in sfile_ids:
             for hfid in hfile_ids:
+                if (sfid, hfid) in emitted_assoc:
+                    continue
+                emitted_assoc.add((sfid, hfid))
                 e_assoc = Edge(sfid, hfid, "association")
-                new_edges_dict["association"].append(e_assoc)
+                add_edge(e_assoc)
 
     # CppUses => uses
-    uses_edges = original_graph.find_edges(label="CppUses")
+    uses_edges = queries.edges("CppUses")
     for ee in uses_edges:
         old_f = ee.source
         old_t = ee.target
-        new_f = combined_mapping.get(old_f)
-        new_t = combined_mapping.get(old_t)
+        new_f = cmget(old_f)
+        new_t = cmget(old_t)
         if new_f in new_file_nodes_dict and new_t:
             e_uses = Edge(new_f, new_t, "uses")
-            new_edges_dict["uses"].append(e_uses)
+            add_edge(e_uses)
 
     # Build final
     new_file_nodes_list = list(new_file_nodes_dict.values())
-    new_edges_list = []
-    for el in new_edges_dict.values():
-        new_edges_list.extend(el)
-
     return (new_file_nodes_list, new_edges_list, combined_mapping)
 
 
-def invert_parent_folder_edges(original_graph, existing_mapping):
+def invert_parent_folder_edges(original_graph, existing_mapping, *, queries=None):
     """
     Invert 'ParentFolder' edges into 'contains' edges.
 
@@ -490,12 +533,17 @@ def invert_parent_folder_edges(original_graph, existing_mapping):
     - For any other node not in existing_mapping, create a new 'Structure'(kind=normalized label).
     - parse name->qualifiedName, etc. from helpers
     - Then if a->b was labeled ParentFolder, we produce b'->a' labeled 'contains'.
+
+    queries: optional GraphQueryCache over original_graph, shared between passes.
     """
+    if queries is None:
+        queries = GraphQueryCache(original_graph)
+
     new_nodes_dict = {}
-    new_edges_dict = defaultdict(list)
+    new_edges_list = []
     combined_mapping = dict(existing_mapping)
 
-    pfolder_edges = original_graph.find_edges(label="ParentFolder")
+    pfolder_edges = queries.edges("ParentFolder")
 
     for e in pfolder_edges:
         old_a_id = e.source
@@ -512,13 +560,9 @@ def invert_parent_folder_edges(original_graph, existing_mapping):
 
         # invert => b'->a' labeled contains
         e_contains = Edge(b_new_id, a_new_id, "contains")
-        new_edges_dict["contains"].append(e_contains)
+        new_edges_list.append(e_contains)
 
     new_nodes_list = list(new_nodes_dict.values())
-    new_edges_list = []
-    for el in new_edges_dict.values():
-        new_edges_list.extend(el)
-
     return (new_nodes_list, new_edges_list, combined_mapping)
 
 
@@ -557,7 +601,7 @@ def ensure_mapped_node_folder_or_structure(old_node, combined_mapping, new_nodes
     return new_id
 
 
-def link_source_parentfolder_structures(original_graph, existing_mapping, new_nodes_list):
+def link_source_parentfolder_structures(original_graph, existing_mapping, new_nodes_list, *, queries=None):
     """
     Looks for old 2-edge paths:
         (e) -[:Source]-> (f) -[:ParentFolder]-> (d)
@@ -572,42 +616,56 @@ def link_source_parentfolder_structures(original_graph, existing_mapping, new_no
          - e' is labeled "Structure"
          => Actually we do f'->e' label="contains" & f' add label Container
 
+    new_nodes_list may be any iterable of the new nodes; it is read once.
+    queries is an optional GraphQueryCache over original_graph, shared between passes.
+    The paths are found by joining each Source edge with the ParentFolder
+    edges out of its target, rather than enumerating them with find_paths.
+
     Returns a list of newly created Edge objects.
     """
+    if queries is None:
+        queries = GraphQueryCache(original_graph)
+
     new_nodes_dict = {n.id: n for n in new_nodes_list}
     new_edge_list = []
+    add_edge = new_edge_list.append
 
-    paths = original_graph.find_paths("Source", "ParentFolder")
-    for path in paths:
-        if len(path) != 2:
-            continue
-        e_source, e_folder = path
-        old_e = e_source.source
+    # Per file: new ids of its mapped ParentFolder targets, translated once
+    # for all the Source edges into that file
+    parent_folders, _ = original_graph.adjacency("ParentFolder")
+    file_folders = {}
+    for e_source in queries.edges("Source"):
         old_f = e_source.target
-        old_d = e_folder.target
-
-        if old_e not in existing_mapping or old_f not in existing_mapping or old_d not in existing_mapping:
+        if old_f not in parent_folders:
             continue
-
-        new_e = existing_mapping[old_e]
-        new_f = existing_mapping[old_f]
-        new_d = existing_mapping[old_d]
-
-        d_node = new_nodes_dict.get(new_d)
+        new_e = existing_mapping.get(e_source.source)
+        new_f = existing_mapping.get(old_f)
+        if new_e is None or new_f is None:
+            continue
+        folder_ids = file_folders.get(old_f)
+        if folder_ids is None:
+            folder_ids = file_folders[old_f] = [
+                existing_mapping[old_d] for old_d in parent_folders[old_f] if old_d in existing_mapping
+            ]
         e_node = new_nodes_dict.get(new_e)
+        if not folder_ids or not e_node:
+            continue
         f_node = new_nodes_dict.get(new_f)
 
-        # (d') -contains->(e') if d' is Container, e' is Container or Structure
-        if d_node and e_node:
-            if "Container" in d_node.labels and ({"Container", "Structure"} & e_node.labels):
-                e_cn = Edge(new_d, new_e, "contains")
-                new_edge_list.append(e_cn)
-
-        # (f') -nests->(e') => actually f'->e' labeled "contains" if both are structure
-        if f_node and e_node:
-            if "Structure" in f_node.labels and "Structure" in e_node.labels:
-                f_node.labels.add("Container")
-                e_nest = Edge(new_f, new_e, "contains")
-                new_edge_list.append(e_nest)
+        for new_d in folder_ids:
+            d_node = new_nodes_dict.get(new_d)
+
+            # (d') -contains->(e') if d' is Container, e' is Container or Structure
+            if d_node:
+                if "Container" in d_node.labels and ({"Container", "Structure"} & e_node.labels):
+                    e_cn = Edge(new_d, new_e, "contains")
+                    add_edge(e_cn)
+
+            # (f') -nests->(e') => actually f'->e' labeled "contains" if both are structure
+            if f_node:
+                if "Structure" in f_node.labels and "Structure" in e_node.labels:
+                    f_node.labels.add("Container")
+                    e_nest = Edge(new_f, new_e, "contains")
+                    add_edge(e_nest)
 
     return new_edge_list